@@ -0,0 +1,112 @@
+import os
+import re
+import json
+import time
+import argparse
+import contextlib
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataflow import Dataflow
+from exporter import start_exports
+from main import PaperCorpus, generate_essay, ESSAY_LENGTHS, CITATION_STYLES
+
+@contextlib.contextmanager
+def timed_stage(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name.rstrip('.')] = round(time.perf_counter() - start, 3)
+
+def load_jobs(jobs_file):
+    jobs = []
+    seen_ids = set()
+    with open(jobs_file, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            # The id names the output files, so anything that could leave the output folder is replaced
+            job["id"] = re.sub(r'[^\w\-]+', '_', str(job.get("id", line_number))).strip('_') or str(line_number)
+            if job["id"] in seen_ids:
+                raise ValueError(f"Duplicate job id '{job['id']}' on line {line_number} of {jobs_file}")
+            seen_ids.add(job["id"])
+            job.setdefault("length", "medium")
+            job.setdefault("language", "English")
+            job.setdefault("citation_style", "APA")
+            # Checked up front so a bad job fails here instead of after its LLM calls and downloads
+            if not str(job.get("instruction") or "").strip():
+                raise ValueError(f"Missing instruction on line {line_number} of {jobs_file}")
+            if job["length"] not in ESSAY_LENGTHS:
+                raise ValueError(f"Unknown length '{job['length']}' on line {line_number} of {jobs_file}, expected one of {', '.join(ESSAY_LENGTHS)}")
+            if job["citation_style"] not in CITATION_STYLES:
+                raise ValueError(f"Unknown citation_style '{job['citation_style']}' on line {line_number} of {jobs_file}, expected one of {', '.join(CITATION_STYLES)}")
+            jobs.append(job)
+    return jobs
+
+def run_job(job, flow, corpus, output_dir, record):
+    timings = {}
+    usage = {}
+    result = {"id": job["id"], "timings": timings, "usage": usage}
+    start = time.perf_counter()
+
+    try:
+        title, paper = generate_essay(job["instruction"], job["length"], job["language"], job["citation_style"], flow, corpus,
+                                      stage=lambda name: timed_stage(timings, name), usage=usage)
+
+        with timed_stage(timings, "Writing outputs"):
+            exports = start_exports(paper)
+            with open(os.path.join(output_dir, f"{job['id']}.md"), 'w', encoding='utf-8') as f:
+                f.write(paper)
+            for export_format, export in exports.items():
+                with open(os.path.join(output_dir, f"{job['id']}.{export_format}"), 'wb') as f:
+                    f.write(export.result())
+
+        result["title"] = title
+    except Exception as e:
+        traceback.print_exc()
+        result["error"] = str(e)
+
+    result["total"] = round(time.perf_counter() - start, 3)
+    print(f"Job {job['id']} finished in {result['total']}s")
+    record(result)
+    return result
+
+def run_batch(jobs_file, output_dir, concurrency):
+    jobs = load_jobs(jobs_file)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Every job shares the same router, worker pool and warm paper index
+    corpus = PaperCorpus()
+    flow = Dataflow(max_workers=max(8, 4 * concurrency))
+
+    # Results are appended as each job finishes so an interrupted run keeps the timings it already has
+    timings_file = os.path.join(output_dir, "timings.jsonl")
+    timings_lock = threading.Lock()
+
+    def record(result):
+        with timings_lock:
+            with open(timings_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda job: run_job(job, flow, corpus, output_dir, record), jobs))
+    elapsed = time.perf_counter() - start
+    flow.shutdown()
+
+    completed = sum(1 for result in results if "error" not in result)
+    print(f"{completed}/{len(jobs)} essays in {elapsed:.1f}s ({completed * 3600 / elapsed:.2f} essays/hour)")
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate essays in bulk from a JSONL file of jobs without the Streamlit UI.")
+    parser.add_argument("jobs_file", help="JSONL file with one job per line: instruction, length, language, citation_style and an optional id")
+    parser.add_argument("--output-dir", default="output", help="Folder for the Markdown, PDF, DOCX and timings.jsonl outputs")
+    parser.add_argument("--concurrency", type=int, default=2, help="Number of essays generated at the same time")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_batch(args.jobs_file, args.output_dir, args.concurrency)
@@ -0,0 +1,72 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cold import budgets in milliseconds for each entry point, kept with headroom over a run with every dependency installed
+BUDGET_FILE = os.path.join(REPO_ROOT, "benchmarks", "import_budget.json")
+
+def profile_import(module):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" lines to stderr
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    imports = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)', line)
+        if match:
+            imports.append((match.group(4).strip(), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return imports
+
+def report(module, top, budget_ms):
+    """Prints the module's import time and its slowest direct imports, and returns False if it is over budget."""
+    imports = profile_import(module)
+    positions = [i for i, (name, _, _, depth) in enumerate(imports) if name == module and depth == 0]
+    if not positions:
+        raise RuntimeError("no top-level line in the -X importtime output, it may already be imported when Python starts")
+    position = positions[-1]
+    total_ms = imports[position][2] / 1000
+
+    print(f"import {module}: {total_ms:.1f} ms" + (f" (budget {budget_ms:.0f} ms)" if budget_ms is not None else ""))
+    # Children are reported before their parent, so the module's direct imports are the depth 1 lines right above it
+    direct_imports = []
+    for entry in reversed(imports[:position]):
+        if entry[3] == 0:
+            break
+        if entry[3] == 1:
+            direct_imports.append(entry)
+    for name, _, cumulative, _ in sorted(direct_imports, key=lambda entry: entry[2], reverse=True)[:top]:
+        print(f"{cumulative / 1000:10.1f} ms  {name}")
+
+    if budget_ms is not None and total_ms > budget_ms:
+        print(f"import {module} is over the {budget_ms:.0f} ms budget")
+        return False
+    return True
+
+def main():
+    with open(BUDGET_FILE, 'r', encoding='utf-8') as f:
+        budgets = json.load(f)
+
+    parser = argparse.ArgumentParser(description="Profile the cold import time of the entry points and check it against benchmarks/import_budget.json.")
+    parser.add_argument("modules", nargs="*", default=list(budgets), help="Modules to import, main for the Streamlit app or batch for the CLI (default: every module with a budget)")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest direct imports to show")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Budget to use instead of the committed one")
+    args = parser.parse_args()
+
+    within_budget = True
+    for module in args.modules:
+        budget_ms = args.budget_ms if args.budget_ms is not None else budgets.get(module)
+        try:
+            within_budget = report(module, args.top, budget_ms) and within_budget
+        except RuntimeError as e:
+            sys.exit(f"Could not profile import {module}: {e}")
+
+    if not within_budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llmrouter import LLMRouter
+from main import paragraph_request
+
+INDEX = "\n".join(f"{numeral}. Section {numeral} about the history and methods of the topic\n   A. First subsection of {numeral}\n   B. Second subsection of {numeral}" for numeral in ["I", "II", "III", "IV"])
+ABSTRACT = " ".join(["This essay studies the topic from its origins to its current methods and open problems."] * 20)
+
+def check_layout(model, num_sections=2, num_paragraphs=3):
+    """Runs one essay's paragraph calls through the fake provider and returns the calls whose shared prefix was not cached."""
+    router = LLMRouter(None, None, None)
+    paragraphs = []
+    misses = []
+
+    for section in range(num_sections):
+        for i in range(num_paragraphs):
+            request = paragraph_request(INDEX, ABSTRACT, [f"doc_{section}.txt"], f"I.{section}: Section {section}", paragraphs, i, num_paragraphs, "English")
+            usage = {}
+            paragraph = router.generate(model, max_tokens=50, temperature=0.85, top_p=0.95, usage=usage, **request)
+            paragraphs.append((f"I.{section}", paragraph))
+
+            # Every call after the first must reuse at least the system prompt and the shared prefix
+            expected = len(request["system"].split()) + len(request["cache_prefix"].split())
+            if (section, i) != (0, 0) and usage["cached_input_tokens"] < expected:
+                misses.append((section, i, usage["cached_input_tokens"], expected))
+
+    return misses
+
+def main():
+    failed = False
+    for model in ["fake-gpt", "fake-claude"]:
+        misses = check_layout(model)
+        print(f"{model}: {'prefix cached on every call' if not misses else f'{len(misses)} calls missed the cache'}")
+        for section, i, cached, expected in misses:
+            print(f"  section {section} paragraph {i}: {cached} cached tokens, expected at least {expected}")
+        failed = failed or bool(misses)
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
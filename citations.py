@@ -0,0 +1,73 @@
+import re
+
+def split_name(author):
+    # Accepts "Last, First" and "First Middle Last"
+    if ',' in author:
+        last, first = [part.strip() for part in author.split(',', 1)]
+    else:
+        parts = author.split()
+        last, first = parts[-1], ' '.join(parts[:-1])
+    return last, first
+
+def initials(first):
+    return ' '.join(f"{part[0]}." for part in re.split(r'[\s\-]+', first) if part)
+
+def format_apa_authors(authors):
+    names = []
+    for author in authors:
+        last, first = split_name(author)
+        names.append(f"{last}, {initials(first)}" if first else last)
+
+    if len(names) == 1:
+        return names[0]
+    if len(names) > 20:
+        return ', '.join(names[:19]) + ', ... ' + names[-1]
+    return ', '.join(names[:-1]) + ', & ' + names[-1]
+
+def format_chicago_authors(authors):
+    names = []
+    for position, author in enumerate(authors):
+        last, first = split_name(author)
+        if not first:
+            names.append(last)
+        elif position == 0:
+            names.append(f"{last}, {first}")
+        else:
+            names.append(f"{first} {last}")
+
+    if len(names) == 1:
+        return names[0]
+    if len(names) > 10:
+        return ', '.join(names[:7]) + ', et al'
+    return ', '.join(names[:-1]) + ', and ' + names[-1]
+
+def format_citation(metadata, citation_style):
+    title = metadata.get("title") or "Untitled"
+    authors = metadata.get("authors") or []
+    doi = metadata.get("doi")
+    link = f" https://doi.org/{doi}" if doi else ""
+
+    if citation_style == "Chicago":
+        year = f"{metadata['year']}." if metadata.get("year") else "n.d."
+        if authors:
+            return f"{format_chicago_authors(authors).rstrip('.')}. {year} *{title}*.{link}"
+        return f"*{title}*. {year}{link}"
+
+    year = metadata.get("year") or "n.d."
+    if authors:
+        return f"{format_apa_authors(authors)} ({year}). *{title}*.{link}"
+    return f"*{title}*. ({year}).{link}"
+
+def sort_key(metadata):
+    authors = metadata.get("authors") or []
+    first = split_name(authors[0])[0] if authors else metadata.get("title") or ""
+    return (first.lower(), metadata.get("year") or "")
+
+def format_references(papers, citation_style):
+    # Each paper is cited once, in alphabetical order as both APA and Chicago require
+    unique_papers = {}
+    for metadata in papers:
+        key = metadata.get("doi") or (metadata.get("title") or "").lower()
+        unique_papers.setdefault(key, metadata)
+
+    return '\n'.join(format_citation(metadata, citation_style) for metadata in sorted(unique_papers.values(), key=sort_key))
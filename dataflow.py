@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class Dataflow:
+    """Runs each task as soon as the futures it depends on have finished."""
+
+    def __init__(self, max_workers: int = 8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, fn, *args, after=()) -> Future:
+        result = Future()
+        pending = [future for future in after if future is not None]
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def run():
+            # If any dependency failed, propagate its error instead of running the task
+            for future in pending:
+                if future.exception() is not None:
+                    result.set_exception(future.exception())
+                    return
+            task = self.executor.submit(fn, *args)
+            task.add_done_callback(lambda done: _copy_future(done, result))
+
+        def dependency_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                run()
+
+        if not pending:
+            run()
+        for future in pending:
+            future.add_done_callback(dependency_done)
+
+        return result
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+def _copy_future(source: Future, target: Future):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
@@ -0,0 +1,119 @@
+import os
+import re
+import json
+import zlib
+import random
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+class MinHash:
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        rng = random.Random(seed)
+        self.shingle_size = shingle_size
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def shingles(self, text):
+        words = re.findall(r'\b\w+\b', text.lower())
+        if len(words) < self.shingle_size:
+            return {' '.join(words)} if words else set()
+        return {' '.join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text):
+        hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in self.shingles(text)]
+        if not hashes:
+            return None
+        return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.permutations]
+
+def merge_signatures(signatures):
+    # The MinHash of a union of shingle sets is the elementwise minimum of their signatures
+    return [min(values) for values in zip(*signatures)]
+
+def similarity(signature, other):
+    return sum(a == b for a, b in zip(signature, other)) / len(signature)
+
+class LSHIndex:
+    def __init__(self, bands: int = 32, rows: int = 4):
+        self.bands = bands
+        self.rows = rows
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+
+    def add(self, key, signature):
+        self.signatures[key] = signature
+        for band, bucket in enumerate(self.buckets):
+            bucket.setdefault(tuple(signature[band * self.rows:(band + 1) * self.rows]), []).append(key)
+
+    def query(self, signature, threshold):
+        candidates = set()
+        for band, bucket in enumerate(self.buckets):
+            candidates.update(bucket.get(tuple(signature[band * self.rows:(band + 1) * self.rows]), []))
+
+        best_key, best_similarity = None, threshold
+        for key in candidates:
+            candidate_similarity = similarity(signature, self.signatures[key])
+            if candidate_similarity >= best_similarity:
+                best_key, best_similarity = key, candidate_similarity
+        return best_key
+
+class Deduplicator:
+    """Collapses near-duplicate papers and chunks to the first copy seen, across every ingested folder."""
+
+    def __init__(self, paper_threshold: float = 0.7, chunk_threshold: float = 0.8):
+        self.minhash = MinHash()
+        self.papers = LSHIndex()
+        self.chunks = LSHIndex()
+        self.paper_threshold = paper_threshold
+        self.chunk_threshold = chunk_threshold
+
+    def sign(self, documents, signatures):
+        """Adds the signature of every document missing from signatures, keyed by chunk file path."""
+        for document in documents:
+            if document["file_path"] not in signatures:
+                signatures[document["file_path"]] = self.minhash.signature(document["content"])
+        return signatures
+
+    def filter(self, folder_path, documents, signatures):
+        """Returns the documents that are not duplicates and the (duplicate, canonical) paper keys collapsed by this call.
+
+        Papers are keyed by (folder, name) so files with the same name in different folders are still compared.
+        """
+        papers = {}
+        for document in documents:
+            papers.setdefault((folder_path, document.get("paper", document["file_path"])), []).append(document)
+
+        unique_documents = []
+        collapsed = []
+        for paper, paper_documents in papers.items():
+            paper_signatures = [signatures[document["file_path"]] for document in paper_documents if signatures.get(document["file_path"])]
+            if not paper_signatures:
+                continue
+
+            paper_signature = merge_signatures(paper_signatures)
+            canonical_paper = self.papers.query(paper_signature, self.paper_threshold)
+            if canonical_paper is not None and canonical_paper != paper:
+                print(f"Skipping {paper[1]} in {paper[0]} as a duplicate of {canonical_paper[1]} in {canonical_paper[0]}")
+                collapsed.append((paper, canonical_paper))
+                continue
+            if canonical_paper is None:
+                self.papers.add(paper, paper_signature)
+
+            for document in paper_documents:
+                signature = signatures.get(document["file_path"])
+                if signature is None or self.chunks.query(signature, self.chunk_threshold) is not None:
+                    continue
+                self.chunks.add(document["file_path"], signature)
+                unique_documents.append(document)
+
+        return unique_documents, collapsed
+
+def load_signatures(folder_path):
+    signatures_file = os.path.join(folder_path, "processed_files", "minhash_signatures.json")
+    if not os.path.exists(signatures_file):
+        return {}
+    with open(signatures_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_signatures(folder_path, signatures):
+    # Stored next to processed_documents.txt so chunks from earlier runs are not hashed again
+    with open(os.path.join(folder_path, "processed_files", "minhash_signatures.json"), 'w', encoding='utf-8') as f:
+        json.dump(signatures, f)
@@ -1,12 +1,13 @@
 import io
 import os
 import re
-from nltk.stem import PorterStemmer, WordNetLemmatizer
-import markdown
-import pdfplumber
-import pypandoc
+import json
+import datetime
 
 def process_documents(folder_path):
+    # Parsers and NLP models are imported here so importing this module stays cheap
+    from nltk.stem import PorterStemmer, WordNetLemmatizer
+
     stemmer = PorterStemmer()
     lemmatizer = WordNetLemmatizer()
     processed_folder = os.path.join(folder_path, "processed_files")
@@ -19,32 +20,44 @@ def process_documents(folder_path):
         with open(processed_documents_file, 'r', encoding='utf-8') as f:
             documents = eval(f.read())
 
-    for root, _, files in os.walk(folder_path):
+    paper_metadata = load_paper_metadata(folder_path)
+
+    for root, dirs, files in os.walk(folder_path):
+        # Chunks and indexes written by earlier runs are outputs, not papers
+        dirs[:] = [d for d in dirs if d != "processed_files"]
         for file in files:
             file_path = os.path.join(root, file)
             file_name, file_ext = os.path.splitext(file)
+            pdf_metadata = None
 
             if file_ext.lower() in [".docx", ".odt", ".pptx", ".ppt", ".doc"]:
+                import pypandoc
                 content = pypandoc.convert_file(file_path, 'markdown', outputfile=None)
                 output_format = ".md"
             elif file_ext.lower() == ".pdf":
+                import pdfplumber
                 with pdfplumber.open(file_path) as pdf:
                     content = "\n".join(page.extract_text() for page in pdf.pages)
+                    pdf_metadata = pdf.metadata
                 output_format = ".txt"
             elif file_ext.lower() in [".txt", ".md"]:
                 with io.open(file_path, 'r', encoding='utf8') as f:
                     content = f.read()
                 if file_ext.lower() == ".md":
+                    import markdown
                     content = markdown.markdown(content)
                 output_format = file_ext
             else:
                 continue
 
-            processed_file_path = os.path.join(processed_folder, f"{file_name}{output_format}")
+            # Chunks are written as <name>_<offset>, so the first chunk marks a file processed by an earlier run
+            processed_file_path = os.path.join(processed_folder, f"{file_name}_0{output_format}")
 
             if os.path.exists(processed_file_path):
                 continue
 
+            paper_metadata[file_name] = extract_metadata(file_name, content, pdf_metadata)
+
             words = re.findall(r'\b\w+\b', content.lower())
             stemmed_words = [stemmer.stem(word) for word in words]
             lemmatized_words = [lemmatizer.lemmatize(word) for word in words]
@@ -70,6 +83,7 @@ def process_documents(folder_path):
 
                 document = {
                     "file_path": chunk_file_path,
+                    "paper": file_name,
                     "content": chunk,
                     "words": words[i:i + chunk_size],
                     "stemmed_words": stemmed_words[i:i + chunk_size],
@@ -88,11 +102,137 @@ def process_documents(folder_path):
     with open(processed_documents_file, 'w', encoding='utf-8') as f:
         f.write(str(documents))
 
+    with open(os.path.join(processed_folder, "paper_metadata.json"), 'w', encoding='utf-8') as f:
+        json.dump(paper_metadata, f, ensure_ascii=False)
+
     return documents
 
+def load_paper_metadata(folder_path):
+    paper_metadata_file = os.path.join(folder_path, "processed_files", "paper_metadata.json")
+    if not os.path.exists(paper_metadata_file):
+        return {}
+    with open(paper_metadata_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def extract_metadata(file_name, content, pdf_metadata=None):
+    # PDF metadata first, then heuristics over the first page; PyPaperBot names files after the paper title
+    pdf_metadata = pdf_metadata or {}
+    first_page = content[:5000]
+
+    title = str(pdf_metadata.get("Title") or "").strip()
+    if len(title) < 10 or title.lower().startswith("microsoft word") or title.lower().endswith((".doc", ".docx", ".pdf", ".tex", ".dvi")):
+        title = re.sub(r'[_\s]+', ' ', file_name).strip()
+
+    authors = split_authors(str(pdf_metadata.get("Author") or "").strip())
+    if not authors:
+        authors = find_header_authors(first_page, title)
+
+    doi = None
+    doi_match = re.search(r'\b10\.\d{4,9}/[^\s"<>]+', first_page)
+    if doi_match:
+        doi = doi_match.group(0).rstrip('.,;)]')
+
+    return {"title": title, "authors": authors, "year": find_year(first_page, doi_match, pdf_metadata), "doi": doi}
+
+INITIALS_PATTERN = re.compile(r'(?:[A-Z]\.?(?:-[A-Z]\.?)?\s*){1,4}')
+
+def spell_initials(initials):
+    # "JR" and "J.R." both become "J. R." so citations keep every initial
+    return ' '.join(f"{letter}." for letter in re.findall(r'[A-Z]', initials))
+
+def last_first(name):
+    # Vancouver style writes "Smith JR": a trailing run of initials is the given names
+    tokens = name.split()
+    position = len(tokens)
+    while position > 1 and INITIALS_PATTERN.fullmatch(tokens[position - 1]):
+        position -= 1
+    if position == len(tokens) or INITIALS_PATTERN.fullmatch(' '.join(tokens[:position])):
+        return name
+    return f"{' '.join(tokens[:position])}, {spell_initials(' '.join(tokens[position:]))}"
+
+def split_authors(author_field):
+    if not author_field:
+        return []
+
+    authors = []
+    for part in re.split(r'\s*;\s*|\s+and\s+|\s*&\s*', author_field):
+        names = [name.strip() for name in part.split(',') if name.strip()]
+        if not names:
+            continue
+        if len(names) == 2 and INITIALS_PATTERN.fullmatch(names[1]):
+            authors.append(f"{names[0]}, {spell_initials(names[1])}")
+        elif len(names) == 2 and len(names[1].split()) == 1:
+            # A lone comma before a single given name is "Last, First", whatever the length of the surname
+            authors.append(f"{names[0]}, {names[1]}")
+        elif len(names) % 2 == 0 and all(len(name.split()) == 1 for name in names):
+            # "Smith, John, Doe, Jane" lists "Last, First" pairs
+            authors.extend(f"{names[k]}, {names[k + 1]}" for k in range(0, len(names), 2))
+        else:
+            authors.extend(last_first(name) for name in names)
+    return authors
+
+HEADER_NAME_PATTERN = re.compile(r"[A-Z][\w'\-]*\.?(?:\s+[A-Z][\w'\-]*\.?){1,3}")
+HEADER_STOPWORDS = {"abstract", "introduction", "journal", "university", "department", "institute", "school", "college",
+                    "research", "article", "review", "proceedings", "conference", "press", "access", "open", "vol",
+                    "volume", "science", "sciences", "letters", "laboratory", "center", "centre", "email", "keywords"}
+
+def find_header_authors(first_page, title):
+    # The author line is usually one of the first lines above the abstract: capitalised names separated by commas or
+    # "and", optionally followed by affiliation markers
+    title_words = set(re.findall(r'\w+', title.lower()))
+    for line in first_page.split('\n')[:15]:
+        if re.match(r'\s*(abstract|resumen|résumé)\b', line, re.IGNORECASE):
+            break
+        words = set(re.findall(r'\w+', line.lower()))
+        if not words or len(line) > 200 or words & HEADER_STOPWORDS or len(words & title_words) > len(words) / 2:
+            continue
+
+        names = []
+        for part in re.split(r'\s*,\s*|\s+and\s+|\s*&\s*', line.strip()):
+            name = re.sub(r'[\d*†‡§¶,]+$', '', part).strip()
+            if name:
+                names.append(name)
+        if names and all(HEADER_NAME_PATTERN.fullmatch(name) for name in names):
+            return names
+    return []
+
+def find_year(first_page, doi_match, pdf_metadata):
+    current_year = datetime.date.today().year
+
+    def valid_years(text):
+        return [int(year) for year in re.findall(r'\b(19[5-9]\d|20\d{2})\b', text) if int(year) <= current_year]
+
+    # New-style arXiv identifiers start with the submission year and month
+    arxiv_match = re.search(r'arXiv:\s*(\d{2})(\d{2})\.\d{4,5}', first_page)
+    if arxiv_match and 1 <= int(arxiv_match.group(2)) <= 12 and 2000 + int(arxiv_match.group(1)) <= current_year:
+        return str(2000 + int(arxiv_match.group(1)))
+
+    # Identifiers such as DOIs and arXiv ids contain digit runs that look like years
+    text = re.sub(r'\b10\.\d{4,9}/[^\s"<>]+|arXiv:\s*[\w.\-/]+|\b\d{4}\.\d{4,5}\b', ' ', first_page)
+
+    candidates = []
+    if doi_match:
+        # The publication line with the DOI usually carries the year too
+        candidates.append(re.sub(r'\b10\.\d{4,9}/[^\s"<>]+', ' ', first_page[max(0, doi_match.start() - 200):doi_match.end() + 200]))
+    candidates.append(' '.join(text.split('\n')[:15]))
+    for candidate in candidates:
+        years = valid_years(candidate)
+        if years:
+            return str(years[0])
+
+    date_match = re.match(r'(?:D:)?(\d{4})', str(pdf_metadata.get("CreationDate") or ""))
+    if date_match and 1950 <= int(date_match.group(1)) <= current_year:
+        return date_match.group(1)
+
+    years = valid_years(text)
+    return str(years[0]) if years else None
+
 def build_inverted_index(documents):
-    inverted_index = {}
-    for doc_id, document in enumerate(documents):
+    return update_inverted_index({}, documents)
+
+def update_inverted_index(inverted_index, documents, start=0):
+    # Doc ids are positions in the caller's documents list, so new documents are offset by start
+    for doc_id, document in enumerate(documents, start=start):
         for n_gram in document["n_grams"]:
             if n_gram not in inverted_index:
                 inverted_index[n_gram] = []
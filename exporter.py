@@ -0,0 +1,313 @@
+import io
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+LIST_ITEM_PATTERN = re.compile(r'^(\s*)(?:[-*+]|(\d+)[.)])\s+(.*)$')
+FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+QUOTE_PATTERN = re.compile(r'^\s*>\s?(.*)$')
+TABLE_SEPARATOR_PATTERN = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+# Underscores only mark emphasis at word boundaries so snake_case and file names stay intact, and no delimiter may
+# sit next to a space inside it so arithmetic such as 2 * 3 * 4 is left alone
+INLINE_PATTERN = re.compile(r'\*\*(?!\s)(.+?)(?<!\s)\*\*(?!\*)|(?<!\w)__(?!\s)(.+?)(?<!\s)__(?!\w)|(?<!\*)\*(?![\s*])(.+?)(?<![\s*])\*(?!\*)|(?<!\w)_(?!\s)(.+?)(?<!\s)_(?!\w)|`([^`]+)`')
+
+def parse_inlines(text):
+    """Splits a line of Markdown into (text, bold, italic) runs."""
+    runs = []
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        if match.start() > position:
+            runs.append((text[position:match.start()], False, False))
+        bold_text = match.group(1) or match.group(2)
+        italic_text = match.group(3) or match.group(4)
+        if bold_text is not None:
+            runs.extend((run_text, True, italic) for run_text, _, italic in parse_inlines(bold_text))
+        elif italic_text is not None:
+            runs.extend((run_text, bold, True) for run_text, bold, _ in parse_inlines(italic_text))
+        else:
+            runs.append((match.group(5), False, False))
+        position = match.end()
+    if position < len(text):
+        runs.append((text[position:], False, False))
+    return runs
+
+def split_table_row(line):
+    return [parse_inlines(cell.strip()) for cell in line.strip().strip('|').split('|')]
+
+def parse_blocks(paper):
+    """Parses the paper's Markdown in one pass into a list of blocks.
+
+    Every block is a dict with a "kind": "heading" (level, runs), "paragraph" (runs), "list_item" (level, runs,
+    ordered, number, start), "quote" (runs), "code" (text) or "table" (rows of cell runs, header first).
+    """
+    blocks = []
+    paragraph_lines = []
+    quote_lines = []
+    # Next number of each open ordered list by depth, so PDF and DOCX number items the same way
+    list_numbers = {}
+
+    def flush():
+        if paragraph_lines:
+            blocks.append({"kind": "paragraph", "runs": parse_inlines(' '.join(paragraph_lines))})
+            paragraph_lines.clear()
+        if quote_lines:
+            blocks.append({"kind": "quote", "runs": parse_inlines(' '.join(quote_lines))})
+            quote_lines.clear()
+
+    lines = paper.replace('\r\n', '\n').split('\n')
+    position = 0
+    while position < len(lines):
+        line = lines[position]
+        position += 1
+        heading = HEADING_PATTERN.match(line)
+        list_item = LIST_ITEM_PATTERN.match(line)
+        fence = FENCE_PATTERN.match(line)
+        quote = QUOTE_PATTERN.match(line)
+
+        if not line.strip():
+            flush()
+            continue
+        if list_item and not quote_lines:
+            flush()
+            level = len(list_item.group(1).expandtabs(4)) // 2
+            for depth in [depth for depth in list_numbers if depth > level]:
+                del list_numbers[depth]
+            block = {"kind": "list_item", "level": level, "runs": parse_inlines(list_item.group(3)), "ordered": list_item.group(2) is not None}
+            if block["ordered"]:
+                block["start"] = level not in list_numbers
+                block["number"] = int(list_item.group(2)) if block["start"] else list_numbers[level]
+                list_numbers[level] = block["number"] + 1
+            else:
+                list_numbers.pop(level, None)
+            blocks.append(block)
+            continue
+
+        previous_blank = position < 2 or not lines[position - 2].strip()
+        if blocks and blocks[-1]["kind"] == "list_item" and not paragraph_lines and not quote_lines and not (heading or fence or quote) and (line[:1].isspace() or not previous_blank):
+            # Indented lines, and unindented ones right below the item, continue the list item
+            blocks[-1]["runs"] = blocks[-1]["runs"] + [(' ', False, False)] + parse_inlines(line.strip())
+            continue
+
+        list_numbers.clear()
+        if fence:
+            flush()
+            code_lines = []
+            while position < len(lines) and not lines[position].strip().startswith(fence.group(1)):
+                code_lines.append(lines[position])
+                position += 1
+            position += 1
+            blocks.append({"kind": "code", "text": '\n'.join(code_lines)})
+        elif heading:
+            flush()
+            blocks.append({"kind": "heading", "level": len(heading.group(1)), "runs": parse_inlines(heading.group(2))})
+        elif '|' in line and position < len(lines) and '|' in lines[position] and TABLE_SEPARATOR_PATTERN.match(lines[position]):
+            flush()
+            rows = [split_table_row(line)]
+            position += 1
+            while position < len(lines) and '|' in lines[position] and lines[position].strip():
+                rows.append(split_table_row(lines[position]))
+                position += 1
+            blocks.append({"kind": "table", "rows": rows})
+        elif quote:
+            if paragraph_lines:
+                flush()
+            quote_lines.append(quote.group(1).strip())
+        elif quote_lines:
+            # Lazy continuation lines belong to the quote
+            quote_lines.append(line.strip())
+        else:
+            paragraph_lines.append(line.strip())
+    flush()
+
+    return blocks
+
+def render_pdf(blocks):
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import cm
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import Paragraph, Preformatted, Spacer, SimpleDocTemplate, Table, TableStyle
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=3*cm, rightMargin=3*cm, topMargin=3*cm, bottomMargin=3*cm)
+    styles = getSampleStyleSheet()
+
+    normal_style = ParagraphStyle(
+        'Normal',
+        fontName='Times-Roman',
+        fontSize=12,
+        leading=24,  # Double line spacing
+        firstLineIndent=1.25*cm,  # First line indent of 1.25 cm
+        alignment=4  # Justified text
+    )
+    quote_style = ParagraphStyle('Quote', parent=normal_style, fontName='Times-Italic', firstLineIndent=0, leftIndent=1.25*cm, rightIndent=1.25*cm, leading=18)
+    code_style = ParagraphStyle('Code', fontName='Courier', fontSize=9, leading=12, leftIndent=0.5*cm)
+    cell_style = ParagraphStyle('Cell', parent=normal_style, firstLineIndent=0, fontSize=10, leading=13, alignment=0)
+
+    # Update styles for headings
+    styles['Heading1'].fontName = 'Times-Bold'
+    styles['Heading1'].fontSize = 18
+    styles['Heading1'].alignment = 1  # Center alignment
+    styles['Heading2'].fontName = 'Times-Bold'
+    styles['Heading2'].fontSize = 16
+    styles['Heading2'].alignment = 1  # Center alignment
+    styles['Heading3'].fontName = 'Times-Bold'
+    styles['Heading3'].fontSize = 14
+    styles['Heading4'].fontName = 'Times-Bold'
+    styles['Heading4'].fontSize = 12
+
+    list_styles = {}
+
+    elements = []
+    for block in blocks:
+        kind = block["kind"]
+        if kind == "heading":
+            elements.append(Paragraph(to_reportlab_markup(block["runs"]), styles[f'Heading{min(block["level"], 4)}']))
+        elif kind == "list_item":
+            level = block["level"]
+            if level not in list_styles:
+                list_styles[level] = ParagraphStyle(f'List{level}', parent=normal_style, firstLineIndent=0, leftIndent=(level + 1) * 0.75*cm, bulletIndent=level * 0.75*cm, leading=18, alignment=0)
+            bullet = f'{block["number"]}.' if block["ordered"] else '•'
+            elements.append(Paragraph(to_reportlab_markup(block["runs"]), list_styles[level], bulletText=bullet))
+        elif kind == "quote":
+            elements.append(Paragraph(to_reportlab_markup(block["runs"]), quote_style))
+        elif kind == "code":
+            elements.append(Preformatted(block["text"], code_style))
+        elif kind == "table":
+            rows = [[Paragraph(to_reportlab_markup(cell), cell_style) for cell in row] for row in block["rows"]]
+            columns = max(len(row) for row in rows)
+            rows = [row + [''] * (columns - len(row)) for row in rows]
+            table = Table(rows, colWidths=[doc.width / columns] * columns, repeatRows=1)
+            table.setStyle(TableStyle([
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ]))
+            elements.append(table)
+        else:
+            elements.append(Paragraph(to_reportlab_markup(block["runs"]), normal_style))
+        elements.append(Spacer(1, 12))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+def to_reportlab_markup(runs):
+    markup = ''
+    for text, bold, italic in runs:
+        text = escape(text, quote=False)
+        if italic:
+            text = f'<i>{text}</i>'
+        if bold:
+            text = f'<b>{text}</b>'
+        markup += text
+    return markup
+
+def add_runs(paragraph, runs):
+    for text, bold, italic in runs:
+        run = paragraph.add_run(text)
+        run.bold = bold or None
+        run.italic = italic or None
+
+def restart_numbering(doc, paragraph, start):
+    # Every "List Number" paragraph shares one numbering, so each new list gets its own copy starting at start
+    numbering = doc.part.numbering_part.numbering_definitions._numbering
+    style_num_id = paragraph.style.element.pPr.numPr.numId.val
+    num = numbering.add_num(numbering.num_having_numId(style_num_id).abstractNumId.val)
+    num.add_lvlOverride(ilvl=0).add_startOverride(start)
+    return num.numId
+
+def render_docx(blocks):
+    from docx import Document
+    from docx.shared import Pt
+
+    doc = Document()
+    list_num_ids = {}
+
+    for block in blocks:
+        kind = block["kind"]
+        if kind == "heading":
+            add_runs(doc.add_heading('', level=min(block["level"], 9)), block["runs"])
+        elif kind == "list_item":
+            level = block["level"]
+            style = 'List Number' if block["ordered"] else 'List Bullet'
+            paragraph = doc.add_paragraph(style=style if level == 0 else f'{style} {min(level + 1, 3)}')
+            if block["ordered"]:
+                if block["start"]:
+                    list_num_ids[level] = restart_numbering(doc, paragraph, block["number"])
+                paragraph._p.get_or_add_pPr().get_or_add_numPr().get_or_add_numId().val = list_num_ids[level]
+            add_runs(paragraph, block["runs"])
+        elif kind == "quote":
+            add_runs(doc.add_paragraph(style='Quote'), block["runs"])
+        elif kind == "code":
+            run = doc.add_paragraph().add_run(block["text"])
+            run.font.name = 'Courier New'
+            run.font.size = Pt(9)
+        elif kind == "table":
+            columns = max(len(row) for row in block["rows"])
+            table = doc.add_table(rows=len(block["rows"]), cols=columns, style='Table Grid')
+            for row, cells in zip(table.rows, block["rows"]):
+                for cell, runs in zip(row.cells, cells):
+                    add_runs(cell.paragraphs[0], runs)
+            for cell in table.rows[0].cells:
+                for run in cell.paragraphs[0].runs:
+                    run.bold = True
+        else:
+            add_runs(doc.add_paragraph(), block["runs"])
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+
+    return buffer.getvalue()
+
+RENDERERS = {"pdf": render_pdf, "docx": render_docx}
+
+class RenderCache:
+    """Keeps the most recent render futures keyed by the paper's content hash and format."""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+render_cache = RenderCache()
+render_executor = ThreadPoolExecutor(max_workers=2)
+
+def content_hash(paper):
+    return hashlib.sha256(paper.encode('utf-8')).hexdigest()
+
+def start_exports(paper, formats=("pdf", "docx")):
+    """Renders the paper in every format off the calling thread and returns a future per format."""
+    key = content_hash(paper)
+    futures = {}
+    blocks = None
+
+    for export_format in formats:
+        # Futures are cached rather than bytes so a rerun during rendering waits for the same render
+        future = render_cache.get((key, export_format))
+        if future is None or (future.done() and future.exception() is not None):
+            # The paper is parsed once and the same blocks feed every renderer
+            if blocks is None:
+                blocks = parse_blocks(paper)
+            future = render_executor.submit(RENDERERS[export_format], blocks)
+            render_cache.put((key, export_format), future)
+        futures[export_format] = future
+
+    return futures
@@ -1,30 +1,60 @@
 import os
+import threading
+from functools import lru_cache
 from typing import List, Dict, Union
-from anthropic import Anthropic
-from openai import OpenAI
 
 class LLMRouter:
     def __init__(self, anthropic_api_key: str, openai_api_key: str, together_api_key: str):
-        self.anthropic_client = Anthropic(api_key=anthropic_api_key)
-        self.openai_client = OpenAI(api_key=openai_api_key)
-        self.together_client = OpenAI(api_key=together_api_key, base_url='https://api.together.xyz/v1')
-
-    def generate(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None) -> Union[str, Dict[str, str]]:
+        # SDK clients are created on first use so importing this module and building the router stay cheap
+        self.anthropic_api_key = anthropic_api_key
+        self.openai_api_key = openai_api_key
+        self.together_api_key = together_api_key
+        self._anthropic_client = None
+        self._openai_client = None
+        self._together_client = None
+        self._client_lock = threading.Lock()
+        self._usage_lock = threading.Lock()
+        self._fake_lock = threading.Lock()
+        self.fake_cache = set()
+        self.fake_requests = []
+
+    @property
+    def anthropic_client(self):
+        with self._client_lock:
+            if self._anthropic_client is None:
+                from anthropic import Anthropic
+                self._anthropic_client = Anthropic(api_key=self.anthropic_api_key)
+            return self._anthropic_client
+
+    @property
+    def openai_client(self):
+        with self._client_lock:
+            if self._openai_client is None:
+                from openai import OpenAI
+                self._openai_client = OpenAI(api_key=self.openai_api_key)
+            return self._openai_client
+
+    @property
+    def together_client(self):
+        with self._client_lock:
+            if self._together_client is None:
+                from openai import OpenAI
+                self._together_client = OpenAI(api_key=self.together_api_key, base_url='https://api.together.xyz/v1')
+            return self._together_client
+
+    def generate(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None, cache_prefix: str = None, usage: Dict[str, int] = None) -> Union[str, Dict[str, str]]:
+        # cache_prefix is stable text placed at the start of the first user message so providers can reuse it across calls
         if model.startswith("claude"):
-            return self._generate_anthropic(model, messages, max_tokens, temperature, top_p, stop_sequences, image_data, system)
+            return self._generate_anthropic(model, messages, max_tokens, temperature, top_p, stop_sequences, image_data, system, cache_prefix, usage)
         elif model.startswith("gpt"):
-            return self._generate_openai(model, messages, max_tokens, temperature, top_p, stop_sequences, image_data, system)
+            return self._generate_openai(model, messages, max_tokens, temperature, top_p, stop_sequences, image_data, system, cache_prefix, usage)
+        elif model.startswith("fake"):
+            return self._generate_fake(model, messages, max_tokens, temperature, top_p, stop_sequences, image_data, system, cache_prefix, usage)
         else:
-            return self._generate_together(model, messages, max_tokens, temperature, top_p, stop_sequences, image_data, system)
-
-    def _generate_anthropic(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None) -> Union[str, Dict[str, str]]:
-        formatted_messages = [{"role": message["role"], "content": message["content"]} for message in messages]
+            return self._generate_together(model, messages, max_tokens, temperature, top_p, stop_sequences, image_data, system, cache_prefix, usage)
 
-        if image_data:
-            formatted_messages[-1]["content"] = [
-                {"type": "image", "source": {"type": "base64", "media_type": image_data["media_type"], "data": image_data["data"]}},
-                {"type": "text", "text": formatted_messages[-1]["content"]}
-            ]
+    def _generate_anthropic(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None, cache_prefix: str = None, usage: Dict[str, int] = None) -> Union[str, Dict[str, str]]:
+        formatted_messages = self._format_anthropic_messages(messages, image_data, cache_prefix)
 
         response = self.anthropic_client.messages.create(
             model=model,
@@ -36,49 +66,159 @@ class LLMRouter:
             system=system
         )
 
+        self.record_usage(usage,
+                           input_tokens=response.usage.input_tokens,
+                           cached_input_tokens=getattr(response.usage, "cache_read_input_tokens", None) or 0,
+                           cache_creation_input_tokens=getattr(response.usage, "cache_creation_input_tokens", None) or 0,
+                           output_tokens=response.usage.output_tokens)
+
         return response.content[0].text
 
-    def _generate_openai(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None) -> Union[str, Dict[str, str]]:
-        formatted_messages = [{"role": message["role"], "content": message["content"]} for message in messages]
+    def _generate_openai(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None, cache_prefix: str = None, usage: Dict[str, int] = None) -> Union[str, Dict[str, str]]:
+        formatted_messages = self._format_openai_messages(messages, image_data, system, cache_prefix)
 
-        if system:
-            formatted_messages.insert(0, {"role": "system", "content": system})
+        response = self.openai_client.chat.completions.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            messages=formatted_messages
+        )
 
-        if image_data:
-            formatted_messages[-1]["content"] = [
-                {"type": "text", "text": formatted_messages[-1]["content"]},
-                {"type": "image_url", "image_url": image_data}
-            ]
+        self._record_openai_usage(usage, response)
 
-        response = self.openai_client.chat.completions.create(
+        return response.choices[0].message.content
+
+    def _generate_together(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None, cache_prefix: str = None, usage: Dict[str, int] = None) -> Union[str, Dict[str, str]]:
+        formatted_messages = self._format_openai_messages(messages, image_data and image_data["data"], system, cache_prefix)
+
+        response = self.together_client.chat.completions.create(
             model=model,
             max_tokens=max_tokens,
             temperature=temperature,
             top_p=top_p,
+            stop=stop_sequences,
             messages=formatted_messages
         )
 
+        self._record_openai_usage(usage, response)
+
         return response.choices[0].message.content
 
-    def _generate_together(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None) -> Union[str, Dict[str, str]]:
+    def _generate_fake(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float, top_p: float, stop_sequences: List[str] = None, image_data: Dict[str, str] = None, system: str = None, cache_prefix: str = None, usage: Dict[str, int] = None) -> Union[str, Dict[str, str]]:
+        # Local provider that formats requests exactly like the real ones and simulates their prompt caching on the
+        # leading content of the request. "fake-claude..." uses the Anthropic layout, any other name the OpenAI one.
+        # Tokens are whitespace-separated words.
+        if model.startswith("fake-claude"):
+            segments = [system or ""]
+            cacheable = None
+            for message in self._format_anthropic_messages(messages, image_data, cache_prefix):
+                blocks = message["content"] if isinstance(message["content"], list) else [{"type": "text", "text": message["content"]}]
+                for block in blocks:
+                    segments.append(f"{message['role']}: {block.get('text', '')}")
+                    # Anthropic caches everything up to the first cache_control breakpoint if that exact prefix was seen
+                    if cacheable is None and "cache_control" in block:
+                        cacheable = tuple(segments)
+            tokens = " ".join(segments).split()
+
+            cached_input_tokens = 0
+            if cacheable is not None:
+                with self._fake_lock:
+                    if cacheable in self.fake_cache:
+                        cached_input_tokens = len(" ".join(cacheable).split())
+                    self.fake_cache.add(cacheable)
+        else:
+            formatted_messages = self._format_openai_messages(messages, image_data, system, cache_prefix)
+            tokens = " ".join(f"{message['role']}: {message['content']}" for message in formatted_messages).split()
+
+            # OpenAI caches automatically, reusing the longest run of leading tokens shared with an earlier request
+            with self._fake_lock:
+                cached_input_tokens = 0
+                for previous in self.fake_requests:
+                    shared = 0
+                    for token, previous_token in zip(tokens, previous):
+                        if token != previous_token:
+                            break
+                        shared += 1
+                    cached_input_tokens = max(cached_input_tokens, shared)
+                self.fake_requests.append(tokens)
+
+        text = " ".join(messages[-1]["content"].split()[:max_tokens])
+        self.record_usage(usage, input_tokens=len(tokens), cached_input_tokens=cached_input_tokens, output_tokens=len(text.split()))
+
+        return text
+
+    def _format_anthropic_messages(self, messages: List[Dict[str, str]], image_data: Dict[str, str] = None, cache_prefix: str = None) -> List[Dict]:
+        formatted_messages = [{"role": message["role"], "content": message["content"]} for message in messages]
+
+        if image_data:
+            formatted_messages[-1]["content"] = [
+                {"type": "image", "source": {"type": "base64", "media_type": image_data["media_type"], "data": image_data["data"]}},
+                {"type": "text", "text": formatted_messages[-1]["content"]}
+            ]
+
+        if cache_prefix:
+            # The breakpoint on the prefix block caches the system prompt and the prefix together
+            first_user = next(message for message in formatted_messages if message["role"] == "user")
+            content = first_user["content"]
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            first_user["content"] = [{"type": "text", "text": cache_prefix, "cache_control": {"type": "ephemeral"}}] + content
+
+        return formatted_messages
+
+    def _format_openai_messages(self, messages: List[Dict[str, str]], image_url: Union[str, Dict[str, str]] = None, system: str = None, cache_prefix: str = None) -> List[Dict]:
         formatted_messages = [{"role": message["role"], "content": message["content"]} for message in messages]
 
+        if cache_prefix:
+            # Prompt caching here is automatic and matches on the exact leading tokens, so the prefix goes first
+            first_user = next(message for message in formatted_messages if message["role"] == "user")
+            first_user["content"] = cache_prefix + first_user["content"]
+
         if system:
             formatted_messages.insert(0, {"role": "system", "content": system})
 
-        if image_data:
+        if image_url:
             formatted_messages[-1]["content"] = [
                 {"type": "text", "text": formatted_messages[-1]["content"]},
-                {"type": "image_url", "image_url": image_data["data"]}
+                {"type": "image_url", "image_url": image_url}
             ]
 
-        response = self.together_client.chat.completions.create(
-            model=model,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p,
-            stop=stop_sequences,
-            messages=formatted_messages
-        )
+        return formatted_messages
+
+    def _record_openai_usage(self, usage: Dict[str, int], response):
+        if response.usage is None:
+            return
 
-        return response.choices[0].message.content
\ No newline at end of file
+        details = getattr(response.usage, "prompt_tokens_details", None)
+        if isinstance(details, dict):
+            cached_input_tokens = details.get("cached_tokens") or 0
+        else:
+            cached_input_tokens = getattr(details, "cached_tokens", None) or 0
+
+        self.record_usage(usage,
+                           input_tokens=response.usage.prompt_tokens,
+                           cached_input_tokens=cached_input_tokens,
+                           output_tokens=response.usage.completion_tokens)
+
+    def record_usage(self, usage: Dict[str, int], **counts: int):
+        if usage is None:
+            return
+        # Calls that share a usage dict can run on different threads
+        with self._usage_lock:
+            for key, value in counts.items():
+                usage[key] = usage.get(key, 0) + value
+
+@lru_cache(maxsize=None)
+def get_llm_router() -> LLMRouter:
+    """Returns the process-wide router; Streamlit reruns and batch jobs all share it."""
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file
+    load_dotenv()
+
+    return LLMRouter(
+        anthropic_api_key=os.environ.get("ANTHROPIC_API_KEY"),
+        openai_api_key=os.environ.get("OPENAI_API_KEY"),
+        together_api_key=os.environ.get("TOGETHER_API_KEY")
+    )
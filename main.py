@@ -1,7 +1,5 @@
 
 import contextlib
-import tempfile
-import shutil
 import os
 
 # Define the context manager in the main script
@@ -16,79 +14,140 @@ def temp_document_context(temp_file_paths):
             os.unlink(path)
 
 
-import io
 import re
 import gc
 import json
-import streamlit as st
+import hashlib
 import subprocess
-from document_processing import process_documents, build_inverted_index
-from search import search
-from llmrouter import LLMRouter
-from docx import Document
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.lib.units import cm
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import Paragraph, Spacer, SimpleDocTemplate
-from reportlab.lib.styles import getSampleStyleSheet
-import markdown
-from markdown.extensions import Extension
-from markdown.treeprocessors import Treeprocessor
-from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Setup LLMRouter
-llm_router = LLMRouter(
-   anthropic_api_key=os.environ.get("ANTHROPIC_API_KEY"),
-   openai_api_key=os.environ.get("OPENAI_API_KEY"),
-   together_api_key=os.environ.get("TOGETHER_API_KEY")
-)
-
-def generate_index_and_abstract(instruction, length, language):
+import threading
+from concurrent.futures import Future
+from document_processing import process_documents, update_inverted_index, load_paper_metadata
+from citations import format_references
+from search import search, SEARCH_TOP_N
+from llmrouter import get_llm_router
+from dataflow import Dataflow
+from dedup import Deduplicator, load_signatures, save_signatures
+from exporter import start_exports
+
+# Streamlit re-executes this script on every interaction, so the router and its clients live at process level
+llm_router = get_llm_router()
+
+def generate_index_and_abstract(instruction, length, language, usage=None):
     messages = [
         {"role": "user", "content": f"Generate an index with points and subpoints, as well as an abstract for an essay based on the following instruction: {instruction}. The length should be {length}."}
     ]
     
-    index_and_abstract = llm_router.generate("claude-3-opus-20240229", messages, max_tokens=2000, temperature=0.95, top_p=1.0, system=f"You are an expert professor with a formed mind and opinions, able to understand and write about complex topics in an academic manner with technical language in perfect {language}, as would be seen from a doctorate. The main sections should be numbered with Roman numerals, the subsections with letters and the subsubsections with Arabic numerals. When introducing the index of the abstract it must be put like 'Index:' / 'Índice:', 'Resumen:' / 'Abstract:' and etc. You must not mention anything outside of the paper/essay itself nor any metarreferencing.")
+    index_and_abstract = llm_router.generate("claude-3-opus-20240229", messages, max_tokens=2000, temperature=0.95, top_p=1.0, system=f"You are an expert professor with a formed mind and opinions, able to understand and write about complex topics in an academic manner with technical language in perfect {language}, as would be seen from a doctorate. The main sections should be numbered with Roman numerals, the subsections with letters and the subsubsections with Arabic numerals. When introducing the index of the abstract it must be put like 'Index:' / 'Índice:', 'Resumen:' / 'Abstract:' and etc. You must not mention anything outside of the paper/essay itself nor any metarreferencing.", usage=usage)
     
     messages.append({"role": "assistant", "content": index_and_abstract})
     messages.append({"role": "user", "content": "Improve the index and abstract, making sure it is innovative, complete, and well-structured."})
     
-    improved_index_and_abstract = llm_router.generate("claude-3-opus-20240229", messages, max_tokens=2000, temperature=0.95, top_p=1.0, system=f"You are an expert professor with a formed mind and opinions, able to understand and write about complex topics in an academic manner with technical language in perfect {language}, as would be seen from a doctorate. The main sections should be numbered with Roman numerals, the subsections with letters and the subsubsections with Arabic numerals. You must not mention anything outside of the paper/essay itself nor any metarreferencing.")
+    improved_index_and_abstract = llm_router.generate("claude-3-opus-20240229", messages, max_tokens=2000, temperature=0.95, top_p=1.0, system=f"You are an expert professor with a formed mind and opinions, able to understand and write about complex topics in an academic manner with technical language in perfect {language}, as would be seen from a doctorate. The main sections should be numbered with Roman numerals, the subsections with letters and the subsubsections with Arabic numerals. You must not mention anything outside of the paper/essay itself nor any metarreferencing.", usage=usage)
     
     return improved_index_and_abstract
 
-def download_papers(queries):
+def generate_queries(index_and_abstract, language, usage=None):
+    queries = llm_router.generate("claude-3-haiku-20240307", [{"role": "user", "content": f"Generate 5 different search queries based on the following index and abstract in {language}:\n\n{index_and_abstract}"}],
+                                  max_tokens=200, temperature=0.6, top_p=1.0, system="You are an AI assistant that helps generate related terms to search academic papers based on this index and abstract. The format must be 'term1, term2, term3'. Separate each terms with commas and do no write anything else but the terms.", usage=usage)
+    print(queries)
+    return [query for query in queries.split(",") if query.strip()]
+
+ESSAY_LENGTHS = ["very short", "short", "medium", "long"]
+CITATION_STYLES = ["APA", "Chicago"]
+
+def load_downloaded_queries():
     downloaded_queries = {}
     if os.path.exists("downloaded_queries.json"):
         with open("downloaded_queries.json", "r") as file:
             downloaded_queries = json.load(file)
-    
-    for query in queries.split(","):
-        if not query.strip():
-            continue
-        if query in downloaded_queries:
-            print(f"Skipping query '{query}' as it has already been downloaded.")
-        else:
-            subprocess.run(["python", "-m", "PyPaperBot", f"--query={query}", "--scholar-pages=1", "--dwn-dir=data", "--max-dwn-cites=1"])
-            downloaded_queries[query] = "data"
-    
-    with open("downloaded_queries.json", "w") as file:
-        json.dump(downloaded_queries, file)
-
-def process_downloaded_papers():
-    folder_path = "data"
-    documents = process_documents(folder_path)
-    print("Documents processed")
-    gc.collect()
-    inverted_index = build_inverted_index(documents)
-    gc.collect()
-    print("Index builded")
-    return documents, inverted_index
+    return downloaded_queries
+
+def download_query(query, downloaded_queries):
+    # Each query gets its own folder so its papers can be indexed as soon as they land. They live outside the
+    # legacy "data" folder so ingesting that folder never walks into them
+    if query in downloaded_queries:
+        print(f"Skipping query '{query}' as it has already been downloaded.")
+    else:
+        # A query with no word characters would otherwise name the papers folder itself
+        slug = re.sub(r'\W+', '_', query.strip().lower()).strip('_') or hashlib.sha1(query.encode('utf-8')).hexdigest()[:12]
+        folder_path = os.path.join("papers", slug)
+        os.makedirs(folder_path, exist_ok=True)
+        subprocess.run(["python", "-m", "PyPaperBot", f"--query={query}", "--scholar-pages=1", f"--dwn-dir={folder_path}", "--max-dwn-cites=1"])
+        downloaded_queries[query] = folder_path
+        with open("downloaded_queries.json", "w") as file:
+            json.dump(downloaded_queries, file)
+    return downloaded_queries[query]
+
+class PaperCorpus:
+    """Downloaded and indexed papers, shared by every essay generated in the same process."""
+
+    def __init__(self):
+        self.documents = []
+        self.inverted_index = {}
+        self.ingested_folders = {}
+        self.paper_metadata = {}
+        self.papers = {}
+        self.deduplicator = Deduplicator()
+        self.downloaded_queries = load_downloaded_queries()
+        self.download_lock = threading.Lock()
+        self.index_lock = threading.RLock()
+
+    def download(self, query):
+        with self.download_lock:
+            return download_query(query, self.downloaded_queries)
+
+    def ingest(self, folder_path):
+        # Queries downloaded before per-query folders existed all point to "data", so each folder is ingested once;
+        # a second caller waits until the first one has indexed it and gets its error if it failed
+        with self.index_lock:
+            ingested = self.ingested_folders.get(folder_path)
+            first = ingested is None
+            if first:
+                ingested = self.ingested_folders[folder_path] = Future()
+        if not first:
+            ingested.result()
+            return
+
+        try:
+            # Processing and hashing are the slow parts, so they run without holding the index lock
+            new_documents = process_documents(folder_path)
+            gc.collect()
+            signatures = self.deduplicator.sign(new_documents, load_signatures(folder_path))
+            save_signatures(folder_path, signatures)
+            metadata = load_paper_metadata(folder_path)
+
+            with self.index_lock:
+                # Papers fetched under several queries or as preprint and published version are only indexed once
+                unique_documents, collapsed = self.deduplicator.filter(folder_path, new_documents, signatures)
+                print(f"Skipped {len(new_documents) - len(unique_documents)} duplicate chunks from {folder_path}")
+                update_inverted_index(self.inverted_index, unique_documents, start=len(self.documents))
+                self.documents.extend(unique_documents)
+
+                # Map each chunk file to its paper's metadata so citations can be formatted without reading the chunks
+                for document in unique_documents:
+                    if document.get("paper") in metadata:
+                        self.papers[(folder_path, document["paper"])] = metadata[document["paper"]]
+                        self.paper_metadata[document["file_path"]] = metadata[document["paper"]]
+
+                # A collapsed copy often has what the canonical one lacks, e.g. the published version's DOI
+                for (_, paper), canonical_paper in collapsed:
+                    merge_metadata(self.papers.get(canonical_paper), metadata.get(paper))
+            gc.collect()
+            print(f"Indexed {folder_path}")
+        except BaseException as e:
+            # Forgotten so the next caller retries the folder instead of treating it as indexed
+            with self.index_lock:
+                del self.ingested_folders[folder_path]
+            ingested.set_exception(e)
+            raise
+        ingested.set_result(folder_path)
+
+def merge_metadata(canonical, duplicate):
+    if canonical is None or duplicate is None:
+        return
+    for key, value in duplicate.items():
+        if value and not canonical.get(key):
+            canonical[key] = value
 
 def extract_sections(text):
     sections = {}
@@ -153,208 +212,256 @@ def extract_points_and_subpoints(index_text):
     return results
 
 
-def generate_paragraphs(index, abstract, documents, inverted_index, length, language):
-    paragraphs = []
-    references = {}
-    
-    points_and_subpoints = extract_points_and_subpoints(index)
-
+def plan_sections(index):
+    sections = []
     headings = []
-    
-    for section_number, point in points_and_subpoints:
+
+    for section_number, point in extract_points_and_subpoints(index):
         full_section = f"{section_number}: {point}"
         if '.' in section_number:
-            full_section = f"{headings[-1]} \t {section_number}: {point}"
-            related_terms = llm_router.generate("claude-3-haiku-20240307", [{"role": "user", "content": f"Generate 3 related terms for the following topic: {point}"}],
-                                                    max_tokens=50, temperature=0.6, top_p=1.0, system="You are an AI assistant that helps generate related terms for a given topic. The format must be 'term1, term2, term3'. Separate each terms with commas and do no write anything else but the terms.")
-                
-            related_terms = related_terms.split(", ")
-            
-            relevant_documents = []
-
-            for term in related_terms:
-                print("Buscando...")
-                relevant_documents = search(term, inverted_index, documents)
-
-            references[section_number] = relevant_documents
-            
-            num_paragraphs = {"very short": 1, "short": 3, "medium": 5, "long": 8}[length]
-            
-            for i in range(num_paragraphs):
-                if i == 0:
-                    messages = [
-                        {"role": "user", "content": f"Write a paragraph for a paper based on the following information:\n\nIndex: {index}\nAbstract: {abstract}\nRelevant documents: {relevant_documents}\nSpecific section: {full_section}\n\nRemember to focus on the specific section and not expand upon other parts of the index. There are {num_paragraphs - i} paragraphs left to write for this section."}
-                    ]
-                else:
-                    messages = [
-                        {"role": "user", "content": f"Write a paragraph for a paper based on the following information:\n\nIndex: {index}\nAbstract: {abstract}\nRelevant documents: {relevant_documents}\nAlready written: {paragraphs}\nSpecific section: {full_section}\n\nRemember to focus on the specific section and not expand upon other parts of the index. There are {num_paragraphs - i} paragraphs left to write for this section."}
-                    ]
-
-                paragraph = llm_router.generate("gpt-4-turbo-preview", messages, max_tokens=400, temperature=0.85, top_p=0.95, system=f"You are an expert professor AI with a formed mind and opinions that writes paragraphs for an academic paper, you are able to understand and write about complex topics in an academic manner with technical language in perfect {language}, as would be seen from a doctorate. Write the paragraph in markdown format. Your paragraph must be written as fully integrated in the text, do not mention anything about its structure nor metarreference anything outside of it.")
-                print(paragraph)
-                paragraphs.append((section_number, paragraph))
+            sections.append((section_number, point, f"{headings[-1]} \t {full_section}"))
         else:
             headings.append(full_section)
 
-    return paragraphs, references
+    return sections
 
-def generate_citations(paper, references, citation_style, language):
-    messages = [
-        {"role": "user", "content": f"Generate citations for the following paper in {citation_style} style. Even if they are repeated, only mention each work once. The references for each section are provided as a dictionary:\n\nPaper:\n{paper}\n\nReferences:\n{json.dumps(references)}"}
-    ]
-    
-    citations = llm_router.generate("claude-3-sonnet-20240229", messages, max_tokens=850, temperature=0.5, top_p=1.0, system=f"You are an AI assistant specialized in writing citations.")
-    
-    return citations
+def generate_related_terms(point, usage=None):
+    related_terms = llm_router.generate("claude-3-haiku-20240307", [{"role": "user", "content": f"Generate 3 related terms for the following topic: {point}"}],
+                                            max_tokens=50, temperature=0.6, top_p=1.0, system="You are an AI assistant that helps generate related terms for a given topic. The format must be 'term1, term2, term3'. Separate each terms with commas and do no write anything else but the terms.", usage=usage)
+
+    return related_terms.split(", ")
+
+def retrieve_documents(related_terms, inverted_index, documents):
+    relevant_documents = []
+
+    for term in related_terms:
+        print("Buscando...")
+        relevant_documents = search(term, inverted_index, documents)
+
+    return relevant_documents
+
+def paragraph_request(index, abstract, relevant_documents, full_section, paragraphs, i, num_paragraphs, language):
+    # The lead-in and the index/abstract are shared by every paragraph call of the essay, so they are sent first and
+    # marked as cacheable; everything that changes between calls comes after them
+    prefix = f"Write a paragraph for a paper based on the following information:\n\nIndex: {index}\nAbstract: {abstract}\n"
+
+    if i == 0:
+        messages = [
+            {"role": "user", "content": f"Relevant documents: {relevant_documents}\nSpecific section: {full_section}\n\nRemember to focus on the specific section and not expand upon other parts of the index. There are {num_paragraphs - i} paragraphs left to write for this section."}
+        ]
+    else:
+        messages = [
+            {"role": "user", "content": f"Relevant documents: {relevant_documents}\nAlready written: {paragraphs}\nSpecific section: {full_section}\n\nRemember to focus on the specific section and not expand upon other parts of the index. There are {num_paragraphs - i} paragraphs left to write for this section."}
+        ]
+
+    system = f"You are an expert professor AI with a formed mind and opinions that writes paragraphs for an academic paper, you are able to understand and write about complex topics in an academic manner with technical language in perfect {language}, as would be seen from a doctorate. Write the paragraph in markdown format. Your paragraph must be written as fully integrated in the text, do not mention anything about its structure nor metarreference anything outside of it."
+
+    return {"messages": messages, "system": system, "cache_prefix": prefix}
+
+def generate_section_paragraphs(index, abstract, relevant_documents, section_number, full_section, paragraphs, length, language, usage=None):
+    num_paragraphs = {"very short": 1, "short": 3, "medium": 5, "long": 8}[length]
+    usage = {} if usage is None else usage
+
+    for i in range(num_paragraphs):
+        request = paragraph_request(index, abstract, relevant_documents, full_section, paragraphs, i, num_paragraphs, language)
+        # Counted on its own first so the log shows this call's cache hits, then added to the essay's totals
+        call_usage = {}
+        paragraph = llm_router.generate("gpt-4-turbo-preview", max_tokens=400, temperature=0.85, top_p=0.95, usage=call_usage, **request)
+        llm_router.record_usage(usage, **call_usage)
+        print(paragraph)
+        print(f"Cached input tokens: {call_usage.get('cached_input_tokens', 0)}/{call_usage.get('input_tokens', 0)}")
+        paragraphs.append((section_number, paragraph))
+
+def resolve_retrievals(retrievals, related_terms, inverted_index, documents, final=False):
+    # A section's retrieval is satisfied once the partial index already fills its search results
+    for section_number, retrieval in retrievals.items():
+        if retrieval.done():
+            continue
+        relevant_documents = retrieve_documents(related_terms[section_number].result(), inverted_index, documents)
+        if final or len(relevant_documents) >= SEARCH_TOP_N:
+            retrieval.set_result(relevant_documents)
+
+def start_essay_pipeline(flow, index_and_abstract, sections, length, language, corpus=None, usage=None):
+    """Schedules download, ingest and writing as a dataflow graph and returns the title, ingest and paragraphs futures."""
+    usage = {} if usage is None else usage
+    index = sections.get('index', '')
+    abstract = sections.get('abstract', '')
+    planned_sections = plan_sections(index)
+
+    # Title and related terms only need the index, so they run while the queries are generated and downloaded
+    title = flow.submit(generate_title, index + abstract, language, usage)
+    related_terms = {section_number: flow.submit(generate_related_terms, point, usage) for section_number, point, _ in planned_sections}
+    retrievals = {section_number: Future() for section_number, _, _ in planned_sections}
+
+    queries = generate_queries(index_and_abstract, language, usage)
+
+    # Downloads run one after another; each query is indexed while the next one downloads
+    corpus = corpus or PaperCorpus()
+
+    def ingest_step(downloaded):
+        corpus.ingest(downloaded.result())
+        with corpus.index_lock:
+            resolve_retrievals(retrievals, related_terms, corpus.inverted_index, corpus.documents)
+
+    def final_step():
+        with corpus.index_lock:
+            resolve_retrievals(retrievals, related_terms, corpus.inverted_index, corpus.documents, final=True)
+
+    downloaded = None
+    ingested = flow.submit(lambda: None, after=list(related_terms.values()))
+    for query in queries:
+        downloaded = flow.submit(corpus.download, query, after=[downloaded])
+        ingested = flow.submit(ingest_step, downloaded, after=[downloaded, ingested])
+    ingested = flow.submit(final_step, after=[ingested])
+
+    def fail_retrievals(done):
+        if done.exception() is not None:
+            for retrieval in retrievals.values():
+                if not retrieval.done():
+                    retrieval.set_exception(done.exception())
+
+    ingested.add_done_callback(fail_retrievals)
+
+    # Sections are written in order because each prompt includes everything already written
+    paragraphs = []
+    references = {}
+
+    def write_section(section_number, full_section):
+        references[section_number] = retrievals[section_number].result()
+        generate_section_paragraphs(index, abstract, references[section_number], section_number, full_section, paragraphs, length, language, usage)
+
+    written = None
+    for section_number, _, full_section in planned_sections:
+        written = flow.submit(write_section, section_number, full_section, after=[retrievals[section_number], written])
+    written = flow.submit(lambda: (paragraphs, references), after=[written])
+
+    return title, ingested, written
 
-def generate_title(index, language):
+def generate_citations(references, paper_metadata, citation_style):
+    papers = []
+
+    for relevant_documents in references.values():
+        for file_path in relevant_documents:
+            metadata = paper_metadata.get(file_path)
+            if metadata is None:
+                # Chunks indexed before metadata extraction existed are named "<paper>_<offset>.<ext>"
+                paper = re.sub(r'_\d+$', '', os.path.splitext(os.path.basename(file_path))[0])
+                metadata = {"title": re.sub(r'[_\s]+', ' ', paper).strip(), "authors": [], "year": None, "doi": None}
+            papers.append(metadata)
+
+    return format_references(papers, citation_style)
+
+def generate_title(index, language, usage=None):
     messages = [
         {"role": "user", "content": f"Generate a title for an essay based on the following index:\n\n{index}"}
     ]
     
-    title = llm_router.generate("claude-3-opus-20240229", messages, max_tokens=100, temperature=0.95, top_p=0.9, system=f"You are an expert AI professor with a formed mind and opinions that specializes in generating titles for academic papers, you are able to understand and write about complex topics in an academic manner with technical language in perfect {language}, as would be seen from a doctorate. You must only generate the title and nothing more, limit yourself to that, do not include anything other than the tile. That is, you must not include 'Title:' or any other variant, simply the plain title.")
+    title = llm_router.generate("claude-3-opus-20240229", messages, max_tokens=100, temperature=0.95, top_p=0.9, system=f"You are an expert AI professor with a formed mind and opinions that specializes in generating titles for academic papers, you are able to understand and write about complex topics in an academic manner with technical language in perfect {language}, as would be seen from a doctorate. You must only generate the title and nothing more, limit yourself to that, do not include anything other than the tile. That is, you must not include 'Title:' or any other variant, simply the plain title.", usage=usage)
     
     return title
 
-def convert_to_pdf(paper):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=3*cm, rightMargin=3*cm, topMargin=3*cm, bottomMargin=3*cm)
-    styles = getSampleStyleSheet()
-    
-    normal_style = ParagraphStyle(
-        'Normal',
-        fontName='Times-Roman',
-        fontSize=12,
-        leading=24,  # Double line spacing
-        firstLineIndent=1.25*cm,  # First line indent of 1.25 cm
-        alignment=4  # Justified text
-    )
+def assemble_paper(title, sections, paragraphs, citations):
+    paper = f"# {title}\n\n## Abstract\n{sections.get('abstract', '')}\n\n## Index\n"
 
-    # Update styles for headings
-    styles['Heading1'].fontName = 'Times-Bold'
-    styles['Heading1'].fontSize = 18
-    styles['Heading1'].alignment = 1  # Center alignment
-    styles['Heading2'].fontName = 'Times-Bold'
-    styles['Heading2'].fontSize = 16
-    styles['Heading2'].alignment = 1  # Center alignment
-
-    elements = []
-
-    # Use BeautifulSoup to ensure HTML tags from Markdown are properly closed
-    md = markdown.Markdown(extensions=['extra', 'nl2br', 'sane_lists'])
-    html = md.convert(paper)
-    soup = BeautifulSoup(html, 'html.parser')
-
-    for tag in soup.find_all(True):
-        text = str(tag.string)
-        if tag.name == 'h1':
-            elements.append(Paragraph(text, styles['Heading1']))
-        elif tag.name == 'h2':
-            elements.append(Paragraph(text, styles['Heading2']))
-        elif tag.name in ['p', 'li']:  # Handle paragraphs and list items similarly
-            elements.append(Paragraph(text, normal_style))
-        elements.append(Spacer(1, 12))
-
-    doc.build(elements)
-    return buffer.getvalue()
-
-def convert_to_docx(paper):
-    doc = Document()
-    
-    md = markdown.Markdown()
-    html = md.convert(paper)
-    
-    for element in md.parser.elements:
-        if element.tag == 'p':
-            doc.add_paragraph(element.text)
-        elif element.tag.startswith('h'):
-            level = int(element.tag[1])
-            doc.add_heading(element.text, level=level)
-        elif element.tag == 'image':
-            doc.add_picture(element.attrib['src'])
-    
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    
-    return buffer.getvalue()
+    # Add index with preserved formatting
+    index_lines = sections.get('index', '').split('\n')
+    for line in index_lines:
+        indent_level = len(line) - len(line.lstrip())
+        if indent_level >= 6:  # Assuming subsubsections are indented by at least 6 spaces
+            paper += f"    - {line.strip()}\n"
+        elif indent_level > 0:  # Assuming subsections are indented but less than subsubsections
+            paper += f"  - {line.strip()}\n"
+        else:  # Main sections with no indentation
+            paper += f"- {line.strip()}\n"
+
+    last_main_section = None  # Keep track of the last main section number added to the paper
+
+    for section_number, paragraph in paragraphs:
+        main_section_part = section_number.split('.')[0]  # Extract the main section part
+        
+        # Check if this is the main section and it's different from the last one added
+        if section_number.count('.') == 0 and main_section_part != last_main_section:
+            last_main_section = main_section_part  # Update the last main section
+            paper += f"\n## {section_number} \n{paragraph}\n"
+        # For subsections and subsubsections, don't add the main section number again
+        elif section_number.count('.') == 1:
+            paper += f"\n### {section_number} \n{paragraph}\n"
+        else:
+            paper += f"\n#### {section_number} \n{paragraph}\n"
+
+    # Format citations with each citation on a new line
+    citation_lines = citations.strip().split('\n')  # Assuming each citation is separated by a newline
+    formatted_citations = '\n'.join([f"- {line.strip()}" for line in citation_lines if line.strip()])  # Prepend '- ' to each citation for Markdown list formatting
+
+    paper += f"\n## References\n{formatted_citations}"
+
+    return paper
+
+def generate_essay(instruction, length, language, citation_style, flow, corpus=None, stage=contextlib.nullcontext, usage=None):
+    """Generates an essay and returns its title and Markdown; token counts of every LLM call are added to usage."""
+    corpus = corpus or PaperCorpus()
+    usage = {} if usage is None else usage
+
+    with stage("Generating index and abstract..."):
+        index_and_abstract = generate_index_and_abstract(instruction, length, language, usage)
+        print(index_and_abstract)
+
+    sections = extract_sections(index_and_abstract)
+    print(sections)
+
+    with stage("Downloading and processing relevant papers..."):
+        print("Downloading relevant papers...")
+        title_future, ingested, written = start_essay_pipeline(flow, index_and_abstract, sections, length, language, corpus, usage)
+        ingested.result()
+        print("Downloaded")
+
+    with stage("Generating essay paragraphs..."):
+        paragraphs, references = written.result()
+
+    with stage("Generating citations..."):
+        citations = generate_citations(references, corpus.paper_metadata, citation_style)
+
+    title = title_future.result()
+    print(f"Token usage: {usage}")
+
+    return title, assemble_paper(title, sections, paragraphs, citations)
 
 def main():
+    import streamlit as st
+
     st.title("Academic Essay Generator")
     
     instruction = st.text_input("Enter your essay instructions")
-    length = st.selectbox("Select essay length", ["very short", "short", "medium", "long"])
+    length = st.selectbox("Select essay length", ESSAY_LENGTHS)
     language = st.selectbox("Select language", ["English", "Spanish", "French"])
-    citation_style = st.selectbox("Select citation style", ["APA", "Chicago"])
+    citation_style = st.selectbox("Select citation style", CITATION_STYLES)
     
-    if st.button("Generate Essay"):
-        with st.spinner("Generating index and abstract..."):
-            index_and_abstract = generate_index_and_abstract(instruction, length, language)
-            print(index_and_abstract)
-        
-        queries = llm_router.generate("claude-3-haiku-20240307", [{"role": "user", "content": f"Generate 5 different search queries based on the following index and abstract in {language}:\n\n{index_and_abstract}"}],
-                                      max_tokens=200, temperature=0.6, top_p=1.0, system="You are an AI assistant that helps generate related terms to search academic papers based on this index and abstract. The format must be 'term1, term2, term3'. Separate each terms with commas and do no write anything else but the terms.")
-        print(queries)
-        
-        with st.spinner("Downloading relevant papers..."):
-            print("Downloading relevant papers...")
-            download_papers(queries)
-            print("Downloaded")
-        
-        with st.spinner("Processing downloaded papers..."):
-            print("Processing downloaded papers...")
-            documents, inverted_index = process_downloaded_papers()
-        
-        with st.spinner("Generating essay paragraphs..."):
-            sections = extract_sections(index_and_abstract)
-            print(sections)
-            paragraphs, references = generate_paragraphs(sections.get('index', ''), sections.get('abstract', ''), documents, inverted_index, length, language)
+    # One corpus per server process, so later clicks reuse the papers and index built by earlier ones
+    corpus = st.cache_resource(PaperCorpus)()
 
-        with st.spinner("Generating citations..."):
-            citations = generate_citations(paragraphs, references, citation_style, language)
+    if st.button("Generate Essay"):
+        flow = Dataflow()
+        try:
+            title, paper = generate_essay(instruction, length, language, citation_style, flow, corpus, stage=st.spinner)
+        finally:
+            flow.shutdown(wait=False)
+
+        # Kept in the session so the essay and its downloads survive reruns, such as the one after clicking a download
+        st.session_state["essay"] = (title, paper)
+        start_exports(paper)
+
+    if "essay" in st.session_state:
+        title, paper = st.session_state["essay"]
+        st.markdown(paper)
 
-        title = generate_title((sections.get('index', "") + sections.get('abstract', '')), language)
-        
-        paper = f"# {title}\n\n## Abstract\n{sections.get('abstract', '')}\n\n## Index\n"
-
-        # Add index with preserved formatting
-        index_lines = sections.get('index', '').split('\n')
-        for line in index_lines:
-            indent_level = len(line) - len(line.lstrip())
-            if indent_level >= 6:  # Assuming subsubsections are indented by at least 6 spaces
-                paper += f"    - {line.strip()}\n"
-            elif indent_level > 0:  # Assuming subsections are indented but less than subsubsections
-                paper += f"  - {line.strip()}\n"
-            else:  # Main sections with no indentation
-                paper += f"- {line.strip()}\n"
-
-        last_main_section = None  # Keep track of the last main section number added to the paper
-
-        for section_number, paragraph in paragraphs:
-            main_section_part = section_number.split('.')[0]  # Extract the main section part
-            
-            # Check if this is the main section and it's different from the last one added
-            if section_number.count('.') == 0 and main_section_part != last_main_section:
-                last_main_section = main_section_part  # Update the last main section
-                paper += f"\n## {section_number} \n{paragraph}\n"
-            # For subsections and subsubsections, don't add the main section number again
-            elif section_number.count('.') == 1:
-                paper += f"\n### {section_number} \n{paragraph}\n"
-            else:
-                paper += f"\n#### {section_number} \n{paragraph}\n"
-
-        # Format citations with each citation on a new line
-        citation_lines = citations.strip().split('\n')  # Assuming each citation is separated by a newline
-        formatted_citations = '\n'.join([f"- {line.strip()}" for line in citation_lines if line.strip()])  # Prepend '- ' to each citation for Markdown list formatting
-
-        paper += f"\n## References\n{formatted_citations}"
+        # Renders are cached by content hash, so reruns reuse the PDF and DOCX instead of building them again
+        exports = start_exports(paper)
+        with st.spinner("Preparing downloads..."):
+            pdf_data = exports["pdf"].result()
+            docx_data = exports["docx"].result()
 
-        st.markdown(paper)
-        
-        pdf_data = convert_to_pdf(paper)
-        # docx_data = convert_to_docx(paper)
-        
         st.download_button("Download PDF", data=pdf_data, file_name=f"{title}.pdf", mime="application/pdf")
-        # st.download_button("Download DOCX", data=docx_data, file_name="essay.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        st.download_button("Download DOCX", data=docx_data, file_name=f"{title}.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
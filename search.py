@@ -1,6 +1,9 @@
 import re
 import bisect
 
+# Number of chunk files returned per query
+SEARCH_TOP_N = 2
+
 def search(query, inverted_index, documents):
     # Directly use the query to search in the inverted index
     query = query.lower().strip()
@@ -52,7 +55,7 @@ def search(query, inverted_index, documents):
     relevant_documents.sort(key=lambda x: x["relevance_score"], reverse=True)
 
     # Return the file paths of the relevant documents
-    return [doc["file_path"] for doc in relevant_documents[:2]]
+    return [doc["file_path"] for doc in relevant_documents[:SEARCH_TOP_N]]
 
 def binary_search(words, word):
     index = bisect.bisect_left(words, word)